@@ -0,0 +1,669 @@
+import aiohttp
+import asyncio
+import orjson
+import io
+import time
+import csv
+import logging
+import atexit
+import queue
+import random
+import threading
+import os
+from abc import ABC, abstractmethod
+from collections import deque, namedtuple
+from operator import attrgetter, itemgetter
+from logging.handlers import QueueHandler, QueueListener
+
+# Code commun aux points d'entrée v3.py (accès direct) et v4.py (via proxies).
+# Chaque point d'entrée choisit un Transport (comment joindre l'API) et un
+# Limiter (à quel rythme), puis appelle run().
+
+INPUT_FILE = "sample_person.csv"
+LOG_FILE = "script.log"
+PROXIES_FILE = "proxies.csv"  # Fichier contenant la liste des proxies
+PROXY_STATE_FILE = "proxy_state.json"  # État des proxies conservé entre deux exécutions
+PROXY_STATE_TTL = 600  # Un proxy vu fonctionnel il y a moins de 10 minutes n'est pas revalidé
+TEST_URL = "https://httpbin.org/ip"  # URL pour tester les proxies
+EWMA_ALPHA = 0.2  # Poids de la dernière mesure dans la latence moyenne d'un proxy
+ERROR_DECAY = 0.9  # Facteur de décroissance du compteur d'erreurs...
+ERROR_DECAY_INTERVAL = 60  # ...appliqué chaque minute
+READ_BUFFER_SIZE = 1 << 20  # Tampon de lecture du CSV (1 Mo)
+# Créés une seule fois, réutilisés à chaque essai. sock_connect borne la connexion au proxy,
+# pour distinguer un proxy injoignable d'une API qui répond lentement
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10, sock_connect=5)
+VALIDATION_TIMEOUT = aiohttp.ClientTimeout(total=5)
+WRITE_BUFFER_SIZE = 1 << 20  # Tampon d'écriture des résultats (1 Mo)
+MAX_RETRIES = 3  # Tentatives par personne
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # Codes HTTP pour lesquels on réessaie
+BACKOFF_FACTOR = 0.5  # Délai de base du backoff exponentiel, en secondes
+BACKOFF_MAX = 120  # Délai maximal entre deux tentatives, en secondes
+HEADERS = {"Connection": "keep-alive", "User-Agent": "getdeadpeople/1.0"}
+
+PERSON_COLUMNS = ["id", "family_name", "name", "patronymic", "birth_date", "death_date"]
+# birth_date_api : date de naissance au format attendu par l'API (AAAAMMJJ), calculée à la lecture
+Person = namedtuple("Person", PERSON_COLUMNS + ["birth_date_api"])
+
+pending = []  # Enregistrements pas encore écrits dans output_file
+pending_ids = []  # Identifiants des personnes traitées, pas encore écrits dans queried_file
+RESULTS_LOCK = threading.Lock()  # Protège pending, pending_ids et saved_count ; les sauvegardes tournent dans un thread
+saved_count = 0
+last_save_time = time.time()
+log_listener = None
+
+def setup_logging():
+    """Configure la journalisation : les appelants ne font que déposer les messages
+    dans une file, un thread dédié les formate et les écrit dans LOG_FILE"""
+    global log_listener
+    if log_listener is not None:
+        return  # Déjà configurée
+    log_queue = queue.Queue(-1)
+    file_handler = logging.FileHandler(LOG_FILE)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_listener = QueueListener(log_queue, file_handler)
+    logging.getLogger().addHandler(QueueHandler(log_queue))
+    logging.getLogger().setLevel(logging.INFO)
+    logging.raiseExceptions = False
+    log_listener.start()
+    atexit.register(log_listener.stop)  # Vide la file avant de quitter
+
+def load_proxies_from_csv(file_path):
+    """Charge les proxies depuis un fichier CSV"""
+    proxies = []
+    try:
+        with open(file_path, newline='', encoding='utf-8') as csvfile:
+            reader = csv.reader(csvfile)
+            for row in reader:
+                if len(row) > 0:
+                    proxy = row[0].strip()
+                    # Vérifier si le proxy commence par http:// ou https://
+                    if not (proxy.startswith('http://') or proxy.startswith('https://')):
+                        proxy = f"http://{proxy}"
+                    proxies.append(proxy)
+        logging.info(f"Chargé {len(proxies)} proxies depuis {file_path}")
+        return proxies
+    except Exception as e:
+        logging.error(f"Erreur lors du chargement des proxies depuis {file_path}: {e}")
+        return []
+
+async def validate_proxy(session, proxy):
+    """Vérifie si un proxy fonctionne"""
+    try:
+        async with session.get(TEST_URL, proxy=proxy, timeout=VALIDATION_TIMEOUT) as response:
+            if response.status == 200:
+                logging.info(f"Proxy validé: {proxy}")
+                return True
+            else:
+                logging.warning(f"Proxy non valide (code {response.status}): {proxy}")
+                return False
+    except Exception as e:
+        logging.warning(f"Proxy non fonctionnel: {proxy}. Erreur: {e}")
+        return False
+
+async def validate_proxies(proxies):
+    """Valide une liste de proxies, toutes les vérifications en même temps"""
+    valid_proxies = []
+    
+    logging.info(f"Validation de {len(proxies)} proxies...")
+    # Pas de limite de connexions : la durée totale reste celle d'un seul timeout
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+        results = await asyncio.gather(*(validate_proxy(session, proxy) for proxy in proxies))
+        
+        for proxy, is_valid in zip(proxies, results):
+            if is_valid:
+                valid_proxies.append(proxy)
+    
+    logging.info(f"Validation terminée. {len(valid_proxies)} proxies valides sur {len(proxies)}")
+    return valid_proxies
+
+def load_proxy_state(file_path=PROXY_STATE_FILE):
+    """Charge l'état des proxies sauvegardé lors de la dernière exécution"""
+    try:
+        with open(file_path, "rb") as statefile:
+            return orjson.loads(statefile.read())
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning(f"État des proxies illisible dans {file_path}, il est ignoré: {e}")
+        return {}
+
+# Gestion des proxies et des limites de taux
+class ProxyManager:
+    # Champs de proxy_usage conservés entre deux exécutions
+    PERSISTED_FIELDS = ("count", "last_reset", "ewma_latency", "error_count", "last_good")
+    
+    def __init__(self, proxies, requests_per_hour, state=None):
+        now = time.time()
+        self.saved_state = state or {}
+        self.proxies = proxies
+        self.proxy_usage = {}
+        for proxy in proxies:
+            saved = self.saved_state.get(proxy, {})
+            # Appliquer la décroissance des erreurs pour le temps écoulé depuis la dernière exécution
+            idle_intervals = int((now - saved.get("decayed_at", now)) // ERROR_DECAY_INTERVAL)
+            self.proxy_usage[proxy] = {
+                "count": saved.get("count", 0),
+                "last_reset": saved.get("last_reset", now),
+                "ewma_latency": saved.get("ewma_latency"),  # Latence moyenne (EWMA), en secondes
+                "error_count": saved.get("error_count", 0.0) * ERROR_DECAY ** max(idle_intervals, 0),  # Erreurs récentes (5xx, timeouts), avec décroissance
+                "last_good": saved.get("last_good"),  # Dernière réponse obtenue via ce proxy
+                "current_weight": 0.0,  # Compteur de déficit du round-robin pondéré
+                "alive": True  # False une fois le proxy marqué comme défaillant
+            }
+        self.proxy_queue = deque(proxies)
+        self.requests_per_hour = requests_per_hour
+        self.last_decay = now
+        self.dead_count = 0
+        self.failed_at = {}  # Proxies injoignables pendant cette exécution, revalidés à la suivante
+        self.lock = threading.Lock()
+        atexit.register(self.save_state)
+    
+    def _weight(self, data):
+        """Poids d'un proxy : quota restant, divisé par sa latence et pénalisé par ses erreurs"""
+        remaining = self.requests_per_hour - data["count"]
+        latency = data["ewma_latency"] if data["ewma_latency"] is not None else 1.0
+        return remaining / max(latency, 1e-3) / (1 + data["error_count"])
+    
+    def get_proxy(self):
+        """Récupère le prochain proxy disponible"""
+        # Utiliser un verrou pour éviter les problèmes de concurrence
+        with self.lock:
+            if not self.proxies:
+                return None
+            
+            current_time = time.time()
+            
+            # Vérifier tous les proxies pour réinitialiser les compteurs si nécessaire
+            for proxy, data in self.proxy_usage.items():
+                if current_time - data["last_reset"] > 3600:  # 1 heure
+                    data["count"] = 0
+                    data["last_reset"] = current_time
+            
+            # Faire décroître les compteurs d'erreurs chaque minute
+            intervals = int((current_time - self.last_decay) // ERROR_DECAY_INTERVAL)
+            if intervals > 0:
+                for data in self.proxy_usage.values():
+                    data["error_count"] *= ERROR_DECAY ** intervals
+                self.last_decay += intervals * ERROR_DECAY_INTERVAL
+            
+            # Round-robin pondéré : chaque proxy disponible accumule son poids,
+            # le plus avancé est choisi puis rétrogradé du poids total
+            total_weight = 0.0
+            best = None
+            for proxy in self.proxy_queue:
+                data = self.proxy_usage[proxy]
+                if not data["alive"]:
+                    continue  # Proxy défaillant, en attente de compactage
+                if data["count"] >= self.requests_per_hour:
+                    continue  # Limite atteinte pour ce proxy
+                weight = self._weight(data)
+                data["current_weight"] += weight
+                total_weight += weight
+                if best is None or data["current_weight"] > self.proxy_usage[best]["current_weight"]:
+                    best = proxy
+            
+            # Si aucun proxy n'est disponible, retourner None
+            if best is None:
+                return None
+            
+            self.proxy_usage[best]["current_weight"] -= total_weight
+            return best
+    
+    def increment_usage(self, proxy):
+        """Incrémente le compteur d'utilisation pour un proxy"""
+        with self.lock:
+            if proxy in self.proxy_usage:
+                self.proxy_usage[proxy]["count"] += 1
+    
+    def record_response(self, proxy, elapsed, error=False):
+        """Met à jour la latence moyenne et le compteur d'erreurs d'un proxy"""
+        with self.lock:
+            if proxy in self.proxy_usage:
+                data = self.proxy_usage[proxy]
+                if data["ewma_latency"] is None:
+                    data["ewma_latency"] = elapsed
+                else:
+                    data["ewma_latency"] = (1 - EWMA_ALPHA) * data["ewma_latency"] + EWMA_ALPHA * elapsed
+                if error:
+                    data["error_count"] += 1
+                else:
+                    data["last_good"] = time.time()
+    
+    def mark_proxy_exhausted(self, proxy):
+        """Considère le quota horaire d'un proxy comme atteint (429 renvoyé par l'API)"""
+        with self.lock:
+            if proxy in self.proxy_usage:
+                self.proxy_usage[proxy]["count"] = self.requests_per_hour
+    
+    def mark_proxy_failed(self, proxy):
+        """Marque un proxy comme défaillant ; il est ignoré jusqu'au prochain compactage"""
+        with self.lock:
+            data = self.proxy_usage.get(proxy)
+            if data is not None and data["alive"]:
+                data["alive"] = False
+                self.dead_count += 1
+                self.failed_at[proxy] = time.time()
+                logging.warning(f"Proxy marqué comme défaillant et retiré: {proxy}")
+                
+                # Compacter la liste une fois qu'un quart des proxies sont défaillants
+                if self.dead_count > len(self.proxies) // 4:
+                    self._compact()
+    
+    def _compact(self):
+        """Retire en une seule passe les proxies défaillants (appelé sous verrou)"""
+        self.proxies = [proxy for proxy in self.proxies if self.proxy_usage[proxy]["alive"]]
+        self.proxy_queue = deque(proxy for proxy in self.proxy_queue if self.proxy_usage[proxy]["alive"])
+        self.proxy_usage = {proxy: data for proxy, data in self.proxy_usage.items() if data["alive"]}
+        self.dead_count = 0
+    
+    def alive_count(self):
+        """Nombre de proxies encore utilisables"""
+        with self.lock:
+            return len(self.proxies) - self.dead_count
+    
+    def save_state(self, file_path=PROXY_STATE_FILE):
+        """Sauvegarde compteurs, latences et proxies défaillants pour la prochaine exécution"""
+        with self.lock:
+            state = dict(self.saved_state)
+            for proxy, data in self.proxy_usage.items():
+                if data["alive"]:
+                    state[proxy] = {field: data[field] for field in self.PERSISTED_FIELDS}
+                    state[proxy]["decayed_at"] = self.last_decay  # error_count est à jour jusqu'à cet instant
+            for proxy, failed_at in self.failed_at.items():
+                state[proxy] = {"failed_at": failed_at}
+        
+        # Écrire dans un fichier temporaire puis le renommer, pour ne jamais laisser d'état tronqué
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, "wb") as statefile:
+            statefile.write(orjson.dumps(state))
+        os.replace(tmp_path, file_path)
+        logging.info(f"État de {len(state)} proxies sauvegardé dans {file_path}")
+
+# Limiters : à quel rythme les requêtes partent
+class Limiter(ABC):
+    @abstractmethod
+    async def acquire(self):
+        """Attend jusqu'à ce qu'une nouvelle requête puisse partir"""
+
+class TokenBucket(Limiter):
+    """Seau à jetons : les jetons s'accumulent pendant les pauses, les rafales partent
+    immédiatement et le débit moyen reste de `capacity` requêtes par `refill_time` secondes.
+    
+    Les jetons restants sont conservés dans state_file entre deux exécutions, pour
+    qu'un redémarrage ne permette pas une nouvelle rafale ; sans état, le seau démarre vide."""
+    def __init__(self, capacity, refill_time=3600, state_file=None):
+        self.capacity = capacity
+        self.rate = capacity / refill_time
+        self.state_file = state_file
+        self.tokens = self._load_tokens()
+        self.last_refill = time.monotonic()
+        self.lock = asyncio.Lock()
+        if state_file is not None:
+            atexit.register(self.save_state)
+    
+    def _load_tokens(self):
+        """Jetons laissés par la dernière exécution, complétés pour le temps écoulé depuis"""
+        if self.state_file is None:
+            return 0.0
+        try:
+            with open(self.state_file, "rb") as statefile:
+                state = orjson.loads(statefile.read())
+            elapsed = max(time.time() - state["saved_at"], 0)
+            return min(self.capacity, state["tokens"] + elapsed * self.rate)
+        except FileNotFoundError:
+            return 0.0
+        except Exception as e:
+            logging.warning(f"État du seau à jetons illisible dans {self.state_file}, il est ignoré: {e}")
+            return 0.0
+    
+    def save_state(self):
+        """Sauvegarde les jetons restants pour la prochaine exécution"""
+        tokens = min(self.capacity, self.tokens + (time.monotonic() - self.last_refill) * self.rate)
+        # Écrire dans un fichier temporaire puis le renommer, pour ne jamais laisser d'état tronqué
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, "wb") as statefile:
+            statefile.write(orjson.dumps({"tokens": tokens, "saved_at": time.time()}))
+        os.replace(tmp_path, self.state_file)
+    
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1
+                self.last_refill = time.monotonic()
+            self.tokens -= 1
+
+class IntervalLimiter(Limiter):
+    """Espace les départs de requêtes d'au moins `interval` secondes ; avec des
+    proxies, le quota horaire de chaque IP est tenu par le ProxyManager"""
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self):
+        async with self.lock:
+            delay = self.next_start - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_start = time.monotonic() + self.interval
+
+def parse_retry_after(value):
+    """Durée en secondes de l'en-tête Retry-After, ou None si absent ou illisible"""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        return None  # Format date HTTP non géré, on retombe sur le backoff
+
+def retry_delay(attempt, retry_after=None):
+    """Délai avant la tentative suivante : Retry-After si fourni, sinon backoff exponentiel avec jitter"""
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_FACTOR * 2 ** attempt, BACKOFF_MAX))
+
+async def read_records(response, payload):
+    """Extrait les enregistrements d'une réponse 200 de l'API"""
+    data = await response.json(content_type=None)
+    if "records" not in data:
+        logging.warning(f"Aucun enregistrement trouvé pour {payload['name']}")
+    return data.get("records", [])
+
+# Transports : comment joindre l'API. Tous partagent la même aiohttp.ClientSession.
+class Transport(ABC):
+    def __init__(self, api_url):
+        self.api_url = api_url
+    
+    async def prepare(self):
+        """Prépare le transport avant la première requête ; False pour arrêter le script"""
+        return True
+    
+    @abstractmethod
+    async def request(self, session, payload, limiter):
+        """Renvoie les enregistrements trouvés, ou None si la requête a échoué.
+        
+        limiter.acquire() est appelé avant chaque tentative, nouveaux essais compris."""
+    
+    def log_status(self):
+        """Journalise l'état du transport lors des sauvegardes intermédiaires"""
+
+class DirectTransport(Transport):
+    """Requêtes envoyées directement depuis l'IP de la machine"""
+    async def request(self, session, payload, limiter):
+        for attempt in range(MAX_RETRIES):
+            await limiter.acquire()  # Chaque tentative compte dans la limite de l'API
+            try:
+                async with session.post(self.api_url, json=payload, timeout=REQUEST_TIMEOUT) as response:
+                    if response.status == 200:
+                        return await read_records(response, payload)
+                    elif response.status in RETRY_STATUSES:
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        if response.status == 429 and retry_after is not None and retry_after > BACKOFF_MAX:
+                            # Attendre ici bloquerait le script ; la personne sera reprise à la prochaine exécution
+                            logging.error(f"Rate limit atteint, l'API demande d'attendre {retry_after:.0f} s. Abandon pour {payload['name']}")
+                            return None
+                        logging.error(f"Erreur {response.status} pour {payload['name']}, nouvel essai")
+                        if attempt < MAX_RETRIES - 1:
+                            await asyncio.sleep(retry_delay(attempt, retry_after))
+                    else:
+                        logging.error(f"Erreur {response.status} pour {payload['name']}")
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error(f"Requête échouée pour {payload['name']}: {e}")
+                if attempt < MAX_RETRIES - 1:
+                    await asyncio.sleep(retry_delay(attempt))
+        
+        logging.error(f"Échec après {MAX_RETRIES} tentatives pour {payload['name']}")
+        return None
+
+class ProxiedTransport(Transport):
+    """Requêtes réparties entre les proxies de PROXIES_FILE"""
+    def __init__(self, api_url, requests_per_hour):
+        super().__init__(api_url)
+        self.requests_per_hour = requests_per_hour
+        self.proxy_manager = None
+    
+    async def prepare(self):
+        # Charger et valider les proxies
+        all_proxies = load_proxies_from_csv(PROXIES_FILE)
+        if not all_proxies:
+            logging.error("Aucun proxy trouvé dans le fichier. Arrêt du script.")
+            return False
+        
+        # Réutiliser l'état de la dernière exécution : les proxies vus fonctionnels
+        # récemment ne sont pas revalidés, tous les autres le sont, défaillants compris
+        proxy_state = load_proxy_state()
+        now = time.time()
+        
+        def seen_recently(proxy):
+            timestamp = proxy_state.get(proxy, {}).get("last_good")
+            return timestamp is not None and now - timestamp < PROXY_STATE_TTL
+        
+        recent_proxies = [proxy for proxy in all_proxies if seen_recently(proxy)]
+        recent_set = set(recent_proxies)  # Ensemble : test d'appartenance en O(1)
+        to_validate = [proxy for proxy in all_proxies if proxy not in recent_set]
+        logging.info(f"{len(recent_proxies)} proxies repris sans validation")
+        
+        validated_proxies = await validate_proxies(to_validate)
+        validated_set = set(validated_proxies)
+        for proxy in to_validate:
+            if proxy in validated_set:
+                proxy_state[proxy] = {**proxy_state.get(proxy, {}), "last_good": now}
+            else:
+                proxy_state[proxy] = {"failed_at": now}
+        
+        valid_proxies = recent_proxies + validated_proxies
+        if not valid_proxies:
+            logging.error("Aucun proxy valide trouvé. Arrêt du script.")
+            return False
+        
+        # Initialiser le gestionnaire de proxies avec les proxies validés et leur état sauvegardé
+        self.proxy_manager = ProxyManager(valid_proxies, self.requests_per_hour, proxy_state)
+        return True
+    
+    async def request(self, session, payload, limiter):
+        proxy_manager = self.proxy_manager
+        for attempt in range(MAX_RETRIES):
+            proxy = proxy_manager.get_proxy()
+            
+            if proxy is None:
+                logging.warning("Tous les proxies ont atteint leur limite ou sont épuisés. Attente de 60 secondes.")
+                await asyncio.sleep(60)  # Attendre avant de réessayer
+                continue
+            
+            await limiter.acquire()
+            started = time.monotonic()
+            try:
+                # Le même pool de connexions est réutilisé quel que soit le proxy
+                async with session.post(
+                    self.api_url,
+                    json=payload,
+                    proxy=proxy,
+                    timeout=REQUEST_TIMEOUT
+                ) as response:
+                    # Incrémenter l'utilisation du proxy et mesurer sa latence
+                    proxy_manager.increment_usage(proxy)
+                    proxy_manager.record_response(proxy, time.monotonic() - started, error=response.status >= 500)
+                    
+                    if response.status == 200:
+                        return await read_records(response, payload)
+                    elif response.status in RETRY_STATUSES:
+                        if response.status == 429:  # Too Many Requests
+                            # Inutile d'attendre : la tentative suivante passe par un autre proxy
+                            logging.warning(f"Rate limit atteint pour le proxy {proxy}. Essai avec un autre proxy.")
+                            proxy_manager.mark_proxy_exhausted(proxy)
+                        else:
+                            logging.error(f"Erreur serveur {response.status} pour {payload['name']} avec proxy {proxy}")
+                            if attempt < MAX_RETRIES - 1:
+                                await asyncio.sleep(retry_delay(attempt, parse_retry_after(response.headers.get("Retry-After"))))
+                    else:
+                        # Erreur définitive : réessayer ne changerait rien
+                        logging.error(f"Erreur {response.status} pour {payload['name']} avec proxy {proxy}")
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error(f"Requête échouée pour {payload['name']} avec proxy {proxy}: {e}")
+                # Seul un échec de connexion au proxy le rend défaillant ; une réponse
+                # lente ou interrompue de l'API ne fait que pénaliser son poids
+                if isinstance(e, (aiohttp.ClientConnectorError, aiohttp.ConnectionTimeoutError)):
+                    proxy_manager.mark_proxy_failed(proxy)
+                else:
+                    proxy_manager.record_response(proxy, time.monotonic() - started, error=True)
+        
+        logging.error(f"Échec après {MAX_RETRIES} tentatives pour {payload['name']}")
+        return None
+    
+    def log_status(self):
+        logging.info(f"Proxies restants: {self.proxy_manager.alive_count()}")
+
+def iter_persons(file_path, required_columns):
+    """Fournit les personnes une par une, pour lancer les requêtes pendant la lecture du fichier.
+    
+    Les colonnes de required_columns doivent figurer dans l'en-tête ; les autres
+    colonnes de PERSON_COLUMNS absentes du fichier valent une chaîne vide."""
+    with open(file_path, newline='', encoding='utf-8', buffering=READ_BUFFER_SIZE) as csvfile:
+        reader = csv.reader(csvfile)
+        # Positions des colonnes, résolues une seule fois depuis l'en-tête
+        header = next(reader, None)
+        if header is None:
+            logging.warning(f"Fichier {file_path} vide, aucune personne à traiter")
+            return
+        missing = [field for field in required_columns if field not in header]
+        if missing:
+            logging.error(f"Colonnes manquantes dans {file_path}: {', '.join(missing)}. Aucune personne traitée.")
+            return
+        # Les colonnes facultatives absentes pointent vers une cellule vide ajoutée en fin de ligne
+        padding = [""] if any(field not in header for field in PERSON_COLUMNS) else []
+        get_fields = itemgetter(*(header.index(field) if field in header else len(header) for field in PERSON_COLUMNS))
+        birth_date = PERSON_COLUMNS.index("birth_date")
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != len(header):
+                logging.warning(f"Ligne {reader.line_num} ignorée : {len(row)} colonnes au lieu de {len(header)}")
+                continue
+            fields = get_fields(row + padding if padding else row)
+            yield Person(*fields, fields[birth_date].replace("-", ""))
+
+def load_done(output_file, queried_file):
+    """Identifiants des personnes traitées lors des exécutions précédentes, d'après output_file et queried_file"""
+    done = set()
+    try:
+        with open(output_file, "rb") as ndjsonfile:
+            for line in ndjsonfile:
+                if line.strip():
+                    done.add(orjson.loads(line).get("person_id"))
+    except FileNotFoundError:
+        pass
+    try:
+        with open(queried_file, newline='', encoding='utf-8') as csvfile:
+            done.update(row[0] for row in csv.reader(csvfile) if row)
+    except FileNotFoundError:
+        pass
+    return done
+
+def save_results(output_file, queried_file):
+    """Ajoute à output_file les enregistrements collectés depuis la dernière sauvegarde, et les personnes traitées à queried_file"""
+    global saved_count
+    # Récupérer le lot en attente sous verrou, l'écrire hors verrou
+    with RESULTS_LOCK:
+        batch = pending[:]
+        pending.clear()
+        person_ids = pending_ids[:]
+        pending_ids.clear()
+    # Un seul gros tampon : le lot part en quelques appels système
+    with io.BufferedWriter(open(output_file, "ab", buffering=0), WRITE_BUFFER_SIZE) as jsonfile:
+        for record in batch:
+            jsonfile.write(orjson.dumps(record))
+            jsonfile.write(b"\n")
+    # Les identifiants en dernier : une personne n'est marquée traitée qu'une fois ses résultats écrits
+    with open(queried_file, "a", newline='', encoding='utf-8') as csvfile:
+        csv.writer(csvfile).writerows([person_id] for person_id in person_ids)
+    with RESULTS_LOCK:
+        saved_count += len(batch)
+    logging.info(f"Résultats sauvegardés avec succès. {saved_count} enregistrements.")
+
+def export_json_array(output_file, json_output_file):
+    """Convertit output_file en un unique tableau JSON dans json_output_file"""
+    with open(output_file, "rb") as ndjsonfile:
+        records = [orjson.loads(line) for line in ndjsonfile if line.strip()]
+    with open(json_output_file, "wb") as jsonfile:
+        jsonfile.write(orjson.dumps(records, option=orjson.OPT_INDENT_2))
+
+async def run(transport, limiter, build_payload, build_records, key_fields, required_columns,
+              concurrency, save_interval, output_file, json_output_file, queried_file):
+    """Interroge l'API pour chaque personne de INPUT_FILE.
+    
+    build_payload(person) construit le corps de la requête, build_records(person, records)
+    complète les enregistrements renvoyés, et key_fields désigne les champs qui
+    identifient une requête : les lignes de même clé partagent un seul appel à l'API,
+    mais chacune reçoit ses propres enregistrements. required_columns liste les colonnes
+    de INPUT_FILE dont le point d'entrée a besoin. La reprise après arrêt se fait
+    par identifiant de personne : build_records doit écrire person_id dans chaque
+    enregistrement, après les champs renvoyés par l'API.
+    
+    output_file (JSON Lines, complété à chaque sauvegarde), json_output_file (tableau
+    JSON écrit à la fin) et queried_file (personnes déjà traitées) sont propres à
+    chaque point d'entrée : leurs requêtes et leurs enregistrements diffèrent."""
+    global last_save_time
+    
+    setup_logging()
+    if not await transport.prepare():
+        return
+    
+    person_key = attrgetter(*key_fields)
+    # Les personnes sont lues au fur et à mesure du traitement
+    persons = iter_persons(INPUT_FILE, required_columns)
+    done = load_done(output_file, queried_file)
+    logging.info(f"{len(done)} personnes déjà traitées, elles seront ignorées")
+    person_count = 0
+    # Une requête par clé : les doublons attendent ou réutilisent la réponse de la première ligne
+    queries = {}
+    
+    async def process_person(session, person):
+        global last_save_time
+        key = person_key(person)
+        query = queries.get(key)
+        if query is None:
+            query = queries[key] = asyncio.ensure_future(transport.request(session, build_payload(person), limiter))
+        records = await query
+        # Échec : la personne sera réinterrogée à la prochaine exécution
+        if records is not None:
+            # Copie par ligne : build_records peut modifier les enregistrements partagés entre doublons
+            result_records = build_records(person, [dict(record) for record in records])
+            with RESULTS_LOCK:
+                pending.extend(result_records)
+                pending_ids.append(person.id)
+        
+        # Vérifier si nous devons sauvegarder les résultats intermédiaires
+        if time.time() - last_save_time > save_interval:
+            last_save_time = time.time()
+            await asyncio.to_thread(save_results, output_file, queried_file)  # Écriture hors de la boucle d'événements
+            transport.log_status()
+    
+    async def worker(session):
+        nonlocal person_count
+        # Les workers partagent un seul itérateur : une ligne n'est lue que lorsqu'un worker est libre
+        for person in persons:
+            if person.id in done:
+                continue  # Déjà traitée lors d'une exécution précédente
+            person_count += 1
+            try:
+                await process_person(session, person)
+            except Exception as e:
+                logging.error(f"Erreur lors du traitement de {person.family_name} {person.name} {person.patronymic}: {e}")
+    
+    connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=600)
+    try:
+        async with aiohttp.ClientSession(connector=connector, headers=HEADERS) as session:
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    finally:
+        # Même après une erreur ou une interruption, ne pas perdre les résultats déjà obtenus
+        save_results(output_file, queried_file)  # Sauvegarde finale
+        export_json_array(output_file, json_output_file)
+    logging.info(f"{person_count} personnes traitées")
+    logging.info(f"Traitement terminé. {saved_count} enregistrements sauvegardés dans {output_file} et {json_output_file}.")
@@ -1,79 +1,49 @@
-import requests
-import json
-import time
-import csv
-import logging
-from datetime import datetime
+import asyncio
+import scraper
+from scraper import DirectTransport, TokenBucket
 
-INPUT_FILE = "sample_person.csv"
-OUTPUT_FILE = "results.json"
-LOG_FILE = "script.log"
+# Direct access to the API, at the rate allowed for a single IP
 API_URL = "https://notariat.ru/api/probate-cases/"
 RATE_LIMIT = 150  # API allows 150 calls per hour
-SLEEP_TIME = 3600 / RATE_LIMIT  # Sleep time between requests to avoid exceeding limit
 SAVE_INTERVAL = 100  # Save results every 5 minutes (300 seconds)
-
-logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(message)s')
-
-results = []
-last_save_time = time.time()
-
-def read_csv(file_path):
-    with open(file_path, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        return list(reader)
-
-def query_api(person):
-    payload = {"name": f"{person['family_name']} {person['name']} {person['patronymic']}"}    
-    response = requests.post(API_URL, json=payload)
-    
-    if response.status_code == 200:
-        return response.json()
-    else:
-        logging.error(f"Error {response.status_code} for {payload['name']}")
-        return {}
-
-def save_results():
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as jsonfile:
-        json.dump(results, jsonfile, ensure_ascii=False, indent=4)
-    logging.info("Results saved successfully.")
-
-def main():
-    global last_save_time
-    persons = read_csv(INPUT_FILE)
-    request_count = 0
-    
-    for person in persons:
-        if request_count >= RATE_LIMIT:
-            logging.info("Rate limit reached. Waiting an hour...")
-            time.sleep(3600)
-            request_count = 0
-        
-        api_response = query_api(person)
-        request_count += 1
-        
-        if "records" in api_response:
-            for record in api_response["records"]:
-                record.update({
-                    "person_id": person["id"],
-                    "family_name": person["family_name"],
-                    "name": person["name"],
-                    "patronymic": person["patronymic"],
-                    "death_date": person["death_date"]
-                })
-                results.append(record)
-        else:
-            logging.warning(f"No records found for {person['family_name']} {person['name']} {person['patronymic']}")
-        
-        time.sleep(SLEEP_TIME)  # Respect API rate limit
-        
-        # Save results every 5 minutes
-        if time.time() - last_save_time > SAVE_INTERVAL:
-            save_results()
-            last_save_time = time.time()
-    
-    save_results()  # Final save at the end
-    logging.info(f"Final results saved to {OUTPUT_FILE}")
+OUTPUT_FILE = "results_v3.ndjson"  # JSON Lines, one record per line, appended on each save
+JSON_OUTPUT_FILE = "results_v3.json"  # Full JSON array written once at the end
+QUERIED_FILE = "queried_v3.csv"  # Ids of persons already processed, so restarts resume where they stopped
+TOKEN_BUCKET_STATE_FILE = "token_bucket_v3.json"  # Tokens left at exit, so a restart cannot burst again
+MAX_CONCURRENCY = 1  # Requests in flight at once; pacing is done by the token bucket
+# The API is queried by full name only, so persons with the same name get the same answer
+KEY_FIELDS = ("family_name", "name", "patronymic")
+# Input columns this script reads; birth_date is not used
+REQUIRED_COLUMNS = ("id", "family_name", "name", "patronymic", "death_date")
+
+def build_payload(person):
+    return {"name": f"{person.family_name} {person.name} {person.patronymic}"}
+
+def build_records(person, records):
+    for record in records:
+        record.update({
+            "person_id": person.id,
+            "family_name": person.family_name,
+            "name": person.name,
+            "patronymic": person.patronymic,
+            "death_date": person.death_date
+        })
+    return records
+
+async def main():
+    await scraper.run(
+        transport=DirectTransport(API_URL),
+        limiter=TokenBucket(RATE_LIMIT, refill_time=3600, state_file=TOKEN_BUCKET_STATE_FILE),
+        build_payload=build_payload,
+        build_records=build_records,
+        key_fields=KEY_FIELDS,
+        required_columns=REQUIRED_COLUMNS,
+        concurrency=MAX_CONCURRENCY,
+        save_interval=SAVE_INTERVAL,
+        output_file=OUTPUT_FILE,
+        json_output_file=JSON_OUTPUT_FILE,
+        queried_file=QUERIED_FILE
+    )
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())